@@ -1,3 +1,9 @@
+import os
+import tempfile
+import time
+from datetime import date
+from pathlib import Path
+
 import streamlit as st
 import yfinance as yf
 import pandas as pd
@@ -12,49 +18,152 @@ st.title("📈 NSE Options Watchlist (Demo Version)")
 # -------------------------------
 stocks = ["RELIANCE.NS", "TCS.NS", "INFY.NS", "HDFCBANK.NS", "ICICIBANK.NS"]
 
-@st.cache_data
-def get_stock_data(ticker):
-    """Fetch stock data safely from Yahoo Finance"""
+CHUNK_SIZE = 50   # tickers per yf.download request
+MAX_RETRIES = 3
+CACHE_DIR = Path(".yf_cache")
+PRICE_COLUMNS = ["Open", "High", "Low", "Close", "Adj Close"]
+FAILURE_TTL = 300   # seconds before a failed chunk is downloaded again
+
+@st.cache_data(max_entries=32)
+def download_batch(tickers, day):
+    """Fetch a batch of tickers from Yahoo Finance in one request, retrying with backoff"""
+    # day is unused here but keys st.cache_data, so a server running past
+    # midnight downloads afresh instead of reusing yesterday's result
+    for attempt in range(MAX_RETRIES):
+        try:
+            raw = yf.download(list(tickers), period="6mo", interval="1d", group_by="ticker",
+                              threads=True, progress=False, auto_adjust=False)
+            if not raw.empty:
+                return raw
+            error = ValueError("empty response")
+        except Exception as e:
+            error = e
+        if attempt < MAX_RETRIES - 1:
+            time.sleep(2 ** attempt)
+    # Raise rather than return None so st.cache_data does not memoise the failure
+    raise RuntimeError(f"no data after {MAX_RETRIES} attempts: {error}")
+
+@st.cache_resource
+def failed_batches():
+    """Recently failed download chunks, mapped to (time of failure, error)"""
+    return {}
+
+def get_stock_data(raw, ticker):
+    """Slice one ticker's data out of a batched download"""
+    if ticker not in raw.columns.get_level_values(0):
+        return None
+    df = raw[ticker].dropna(how="all")
+    if df.empty:
+        return None
+    # float32 is ample for daily prices (ticks of 0.05) and halves memory
+    return df.astype({col: "float32" for col in PRICE_COLUMNS if col in df.columns})
+
+def cache_path(ticker, day):
+    """On-disk cache file for a ticker's data, bucketed by day"""
+    return CACHE_DIR / f"{ticker}_{day}.parquet"
+
+@st.cache_data(max_entries=256)
+def load_parquet(path):
+    """Read a cache file once per process; the dated path keys the memo"""
+    return pd.read_parquet(path)
+
+def read_cached(ticker, day):
+    """Load the day's cached data for a ticker, if any"""
+    path = cache_path(ticker, day)
+    # Only hits go through load_parquet, so a miss is never memoised
+    if not path.exists():
+        return None
     try:
-        df = yf.download(ticker, period="6mo", interval="1d")
-        if df.empty:
-            return None
-        df["Ticker"] = ticker
-        return df
-    except Exception as e:
-        st.error(f"❌ Error fetching {ticker}: {e}")
+        return load_parquet(str(path))
+    except Exception:
         return None
 
+def write_cached(ticker, day, df):
+    """Atomically store a ticker's data and drop older days' files"""
+    path = cache_path(ticker, day)
+    tmp = None
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        # Unique temp name so concurrent sessions never write into the same file
+        with tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix=".tmp", delete=False) as f:
+            tmp = f.name
+        df.to_parquet(tmp)
+        os.replace(tmp, path)
+        tmp = None
+        for old in CACHE_DIR.glob(f"{ticker}_*.parquet"):
+            if old != path:
+                old.unlink(missing_ok=True)
+    except Exception as e:
+        st.warning(f"⚠️ Could not cache {ticker}: {e}")
+    finally:
+        if tmp is not None:
+            Path(tmp).unlink(missing_ok=True)
+
 # -------------------------------
 # Fetch all stock data
 # -------------------------------
-data_frames = []
-for stock in stocks:
-    df = get_stock_data(stock)
-    if df is not None:
-        data_frames.append(df)
+today = date.today()
+cached = {stock: read_cached(stock, today) for stock in stocks}
+missing = [stock for stock, df in cached.items() if df is None]
+
+# Failures are not cached by download_batch, so remember them here for a
+# while to keep reruns from repeating the retries and backoff every time
+failures = failed_batches()
+now = time.time()
+for key in [key for key, (failed_at, _) in failures.items() if now - failed_at >= FAILURE_TTL]:
+    failures.pop(key, None)
+
+for start in range(0, len(missing), CHUNK_SIZE):
+    chunk = missing[start:start + CHUNK_SIZE]
+    key = (tuple(chunk), today)
+    failed = failures.get(key)
+    if failed is not None:
+        st.error(f"❌ Error fetching {', '.join(chunk)}: {failed[1]}")
+        continue
+    try:
+        raw = download_batch(*key)
+    except Exception as e:
+        failures[key] = (time.time(), e)
+        st.error(f"❌ Error fetching {', '.join(chunk)}: {e}")
+        continue
+    for stock in chunk:
+        df = get_stock_data(raw, stock)
+        if df is not None:
+            write_cached(stock, today, df)
+            cached[stock] = df
+
+data_frames = {stock: df for stock, df in cached.items() if df is not None}
 
 if not data_frames:
     st.error("⚠️ Could not fetch any stock data. Try again later.")
     st.stop()
 
-df = pd.concat(data_frames)
-
-# -------------------------------
-# Fix MultiIndex issue
-# -------------------------------
-if isinstance(df.columns, pd.MultiIndex):
-    df.columns = [' '.join(col).strip() for col in df.columns.values]
+# Frames are sliced per ticker from the batch download, so their columns are
+# already flat; keying the concat by ticker gives a (Ticker, Date) index
+df = pd.concat(data_frames, names=["Ticker", "Date"])
 
 # -------------------------------
 # Add indicators
 # -------------------------------
-try:
-    df["Daily Return"] = df["Adj Close"].pct_change()
-    df["Volatility"] = df["Daily Return"].rolling(window=20).std()
-    df["Opportunity Score"] = (df["Daily Return"] * 100) / (df["Volatility"] + 1e-6)
-except Exception as e:
-    st.error(f"⚠️ Error creating indicators: {e}")
+@st.cache_data(ttl=3600)
+def add_indicators(df):
+    """Add Daily Return, Volatility and Opportunity Score columns"""
+    try:
+        # Group by ticker so returns and rolling windows stay on each ticker's
+        # own dates: a bar missing for one ticker only costs that ticker a day
+        daily_return = df.groupby(level="Ticker", sort=False)["Adj Close"].pct_change(fill_method=None)
+        volatility = (daily_return.groupby(level="Ticker", sort=False)
+                      .rolling(window=20).std().droplevel(0))
+        return df.assign(**{
+            "Daily Return": daily_return,
+            "Volatility": volatility,
+            "Opportunity Score": (daily_return * 100) / (volatility + 1e-6),
+        })
+    except Exception as e:
+        st.error(f"⚠️ Error creating indicators: {e}")
+        return df
+
+df = add_indicators(df)
 
 # -------------------------------
 # Show raw data
@@ -65,9 +174,14 @@ st.dataframe(df.tail(10))
 # -------------------------------
 # Show top opportunities
 # -------------------------------
-if "Opportunity Score" in df.columns and not df["Opportunity Score"].isnull().all():
-    top_stocks = df.sort_values(by="Opportunity Score", ascending=False).head(5)
+if "Opportunity Score" in df.columns:
+    # nlargest ranks NaN last but still pads with it, so drop those rows
+    top_stocks = df.nlargest(5, "Opportunity Score").dropna(subset=["Opportunity Score"])
+else:
+    top_stocks = df.iloc[0:0]
+if not top_stocks.empty:
     st.subheader("🚀 Top 5 Option Opportunities")
+    top_stocks = top_stocks.reset_index(level="Ticker")
     st.dataframe(top_stocks[["Ticker", "Adj Close", "Daily Return", "Volatility", "Opportunity Score"]])
 else:
     st.warning("⚠️ No valid Opportunity Score found. Data may be missing or incomplete.")
@@ -77,7 +191,10 @@ else:
 # -------------------------------
 selected_ticker = st.selectbox("🔎 Select a stock to view details", stocks)
 
-stock_df = df[df["Ticker"] == selected_ticker]
+if selected_ticker in df.index.unique(level="Ticker"):
+    stock_df = df.xs(selected_ticker, level="Ticker")
+else:
+    stock_df = df.iloc[0:0]
 if not stock_df.empty:
     if "Adj Close" in stock_df.columns:
         st.line_chart(stock_df["Adj Close"], use_container_width=True)